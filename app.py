@@ -1,11 +1,22 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import datetime
 import time
-import pytz
 import json
+import math
 import os
-import re
+import queue
+import tempfile
+import threading
 import unicodedata
+from concurrent.futures import Future
+from enum import IntEnum
+from zoneinfo import ZoneInfo
+
+try:
+    import orjson
+except ImportError:  # orjson が無い環境では標準の json を使う
+    orjson = None
 
 # ページ設定
 st.set_page_config(
@@ -18,295 +29,37 @@ st.set_page_config(
 # 設定ファイルのパス
 SETTINGS_FILE = "timer_settings.json"
 
-# --- ユーティリティ ---
-def parse_time_input(time_str):
-    """
-    様々な時刻入力フォーマットを解析
-    例: "07:00", "700", "0700", "7:00", "7", "19:30", "1930" など
-    """
-    if not time_str:
-        return None
-
-    # 全角などを正規化してから数字とコロンのみを抽出
-    time_str = unicodedata.normalize('NFKC', str(time_str))
-    clean_str = re.sub(r'[^\d:]', '', time_str)
-
-    try:
-        # コロンが含まれている場合
-        if ':' in clean_str:
-            parts = clean_str.split(':')
-            if len(parts) == 2:
-                hour = int(parts[0])
-                minute = int(parts[1])
-            else:
-                return None
-
-        # コロンが含まれていない場合
-        else:
-            if len(clean_str) == 1:  # "7" -> "07:00"
-                hour = int(clean_str)
-                minute = 0
-            elif len(clean_str) == 2:  # "07" -> "07:00"
-                hour = int(clean_str)
-                minute = 0
-            elif len(clean_str) == 3:  # "700" -> "07:00"
-                hour = int(clean_str[0])
-                minute = int(clean_str[1:3])
-            elif len(clean_str) == 4:  # "0700" -> "07:00"
-                hour = int(clean_str[0:2])
-                minute = int(clean_str[2:4])
-            else:
-                return None
-
-        # 時刻の妥当性チェック
-        if 0 <= hour <= 23 and 0 <= minute <= 59:
-            return datetime.time(hour, minute)
-        else:
-            return None
-
-    except (ValueError, IndexError):
-        return None
-
-
-def parse_duration_input(duration_str):
-    """
-    プレゼン時間の入力フォーマットを解析
-    例: "15:00", "1500", "1:30", "90", "15" など
-
-    仕様:
-    - コロン形式の「分:秒」は分と秒をそのまま解釈
-    - コロンがない場合は、末尾2桁を秒、それ以前を分として解釈
-      （例: "1500" -> 15分0秒, "130" -> 1分30秒）
-    - 2桁以下の数字は秒として扱う
-    """
-    if not duration_str:
-        return None
-
-    # 全角などを正規化してから数字とコロンのみを抽出
-    duration_str = unicodedata.normalize('NFKC', str(duration_str))
-    clean_str = re.sub(r'[^\d:]', '', duration_str)
 
-    try:
-        # コロンが含まれている場合（分:秒）
-        if ':' in clean_str:
-            parts = clean_str.split(':')
-            if len(parts) == 2:
-                minutes = int(parts[0])  # 上限撤廃
-                seconds = int(parts[1])
-                if minutes >= 0 and 0 <= seconds <= 59:
-                    total = minutes * 60 + seconds
-                    if total > 0:
-                        return total
-            return None
+class TimerMode(IntEnum):
+    """表示モード（セッション状態と設定ファイルには値の整数で持つ）"""
+    CLOCK = 0
+    PRESENTATION = 1
 
-        # コロンが含まれていない場合
-        else:
-            # 2桁以下は秒として扱う
-            if len(clean_str) <= 2:
-                seconds = int(clean_str)
-                if seconds > 0:
-                    return seconds
-                return None
-
-            # それ以上は末尾2桁を秒、残りを分として扱う
-            minutes = int(clean_str[:-2])
-            seconds = int(clean_str[-2:])
-            if minutes >= 0 and 0 <= seconds <= 59:
-                total = minutes * 60 + seconds
-                if total > 0:
-                    return total
-            return None
 
-    except (ValueError, IndexError):
-        return None
-
-
-def load_settings():
-    """設定を読み込み（プレゼンタイマー機能も含む）"""
-    try:
-        if os.path.exists(SETTINGS_FILE):
-            with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                time_obj = datetime.datetime.strptime(data['time'], '%H:%M').time()
-                return (
-                    time_obj,
-                    data['suffix'],
-                    data.get('timestamp', ''),
-                    data.get('color_state', False),
-                    data.get('force_color', False),
-                    data.get('timer_mode', 'clock'),  # 'clock' or 'presentation'
-                    data.get('presentation_duration', 900),  # 秒
-                    data.get('timer_started', False),
-                    data.get('timer_start_time', ''),
-                    data.get('timer_paused', False),
-                    data.get('timer_pause_time', 0)
-                )
-    except Exception:
-        pass
-    return datetime.time(23, 59), "から開始", "", False, False, "clock", 900, False, "", False, 0
+# 旧形式の設定ファイルでは表示モードを文字列で保存していた
+_LEGACY_TIMER_MODES = {'clock': TimerMode.CLOCK, 'presentation': TimerMode.PRESENTATION}
 
+# 保存をまとめる間隔（秒）。この間に届いた設定は最新の1件だけを書き込む
+WRITE_COALESCE = 0.2
 
-def save_settings(target_time, suffix, color_state=False, force_color=False, timer_mode="clock",
-                 presentation_duration=900, timer_started=False, timer_start_time="",
-                 timer_paused=False, timer_pause_time=0):
-    """設定を保存（プレゼンタイマー機能も含む）"""
-    try:
-        data = {
-            'time': target_time.strftime('%H:%M'),
-            'suffix': suffix,
-            'color_state': color_state,
-            'force_color': force_color,
-            'timestamp': datetime.datetime.now().isoformat(),
-            'timer_mode': timer_mode,
-            'presentation_duration': int(presentation_duration),
-            'timer_started': bool(timer_started),
-            'timer_start_time': timer_start_time,
-            'timer_paused': bool(timer_paused),
-            'timer_pause_time': int(timer_pause_time)
-        }
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False)
-        return True
-    except Exception:
-        return False
+# 日本時間と曜日の表記
+JST = ZoneInfo('Asia/Tokyo')
+WEEKDAYS = ('月', '火', '水', '木', '金', '土', '日')
 
+# 表示更新の間隔（秒）。目標時刻の前後 TICK_NEAR_WINDOW 秒は TICK_NEAR 間隔で確認する
+# （TICK_MAX は他のユーザーの変更を取り込むまでの最長の待ち時間でもある）
+TICK_MIN = 0.2
+TICK_MAX = 1.0
+TICK_NEAR = 0.25
+TICK_NEAR_WINDOW = 3
+# 秒の切り替わりまでこの秒数を切っていたら、切り替わるのを待ってから描画する
+TICK_GUARD = 0.1
 
-# 設定を読み込み
-shared_time, shared_suffix, last_timestamp, shared_color_state, shared_force_color, \
-shared_timer_mode, shared_presentation_duration, shared_timer_started, shared_timer_start_time, \
-shared_timer_paused, shared_timer_pause_time = load_settings()
-
-# セッション状態の初期化
-if 'target_time' not in st.session_state:
-    st.session_state.target_time = shared_time
-if 'suffix' not in st.session_state:
-    st.session_state.suffix = shared_suffix
-if 'last_timestamp' not in st.session_state:
-    st.session_state.last_timestamp = last_timestamp
-if 'time_reached' not in st.session_state:
-    st.session_state.time_reached = False
-if 'editing' not in st.session_state:
-    st.session_state.editing = False
-if 'force_color_change' not in st.session_state:
-    st.session_state.force_color_change = False
-if 'timer_mode' not in st.session_state:
-    st.session_state.timer_mode = shared_timer_mode
-if 'presentation_duration' not in st.session_state:
-    st.session_state.presentation_duration = shared_presentation_duration
-if 'timer_started' not in st.session_state:
-    st.session_state.timer_started = shared_timer_started
-if 'timer_start_time' not in st.session_state:
-    st.session_state.timer_start_time = shared_timer_start_time
-if 'timer_paused' not in st.session_state:
-    st.session_state.timer_paused = shared_timer_paused
-if 'timer_pause_time' not in st.session_state:
-    st.session_state.timer_pause_time = shared_timer_pause_time
-
-# 他のユーザーの変更をチェック
-current_time, current_suffix, current_timestamp, current_color_state, current_force_color, \
-current_timer_mode, current_presentation_duration, current_timer_started, current_timer_start_time, \
-current_timer_paused, current_timer_pause_time = load_settings()
-
-if current_timestamp != st.session_state.last_timestamp and current_timestamp != "":
-    st.session_state.target_time = current_time
-    st.session_state.suffix = current_suffix
-    st.session_state.last_timestamp = current_timestamp
-    st.session_state.time_reached = current_color_state
-    st.session_state.force_color_change = current_force_color
-    st.session_state.timer_mode = current_timer_mode
-    st.session_state.presentation_duration = current_presentation_duration
-    st.session_state.timer_started = current_timer_started
-    st.session_state.timer_start_time = current_timer_start_time
-    st.session_state.timer_paused = current_timer_paused
-    st.session_state.timer_pause_time = current_timer_pause_time
-
-# 日本時間の設定
-jst = pytz.timezone('Asia/Tokyo')
-now = datetime.datetime.now(jst)
-
-# --- プレゼンタイマーのロジック（判定のみここで実施）---
-if st.session_state.timer_mode == "presentation":
-    # 残り秒数の計算（ここでは副作用なし）
-    if st.session_state.timer_started and not st.session_state.timer_paused:
-        if st.session_state.timer_start_time:
-            start_time = datetime.datetime.fromisoformat(st.session_state.timer_start_time)
-            elapsed_seconds = (now - start_time).total_seconds()
-            remaining_seconds = st.session_state.presentation_duration - elapsed_seconds
-            # 時間切れの判定
-            if remaining_seconds <= 0 and not st.session_state.time_reached:
-                st.session_state.time_reached = True
-                st.session_state.force_color_change = True
-                save_settings(
-                    st.session_state.target_time,
-                    st.session_state.suffix,
-                    True, True,
-                    st.session_state.timer_mode,
-                    st.session_state.presentation_duration,
-                    st.session_state.timer_started,
-                    st.session_state.timer_start_time,
-                    st.session_state.timer_paused,
-                    st.session_state.timer_pause_time
-                )
-                st.balloons()
-        else:
-            remaining_seconds = st.session_state.presentation_duration
-    elif st.session_state.timer_paused:
-        remaining_seconds = st.session_state.timer_pause_time
-    else:
-        # 未開始
-        remaining_seconds = st.session_state.presentation_duration
-        if st.session_state.time_reached:
-            st.session_state.time_reached = False
-            st.session_state.force_color_change = False
-            save_settings(
-                st.session_state.target_time,
-                st.session_state.suffix,
-                False, False,
-                st.session_state.timer_mode,
-                st.session_state.presentation_duration,
-                st.session_state.timer_started,
-                st.session_state.timer_start_time,
-                st.session_state.timer_paused,
-                st.session_state.timer_pause_time
-            )
-else:
-    # 通常の時計モード
-    target_dt = datetime.datetime.combine(datetime.date.today(), st.session_state.target_time)
-    target_dt = jst.localize(target_dt)
-    current_time_reached = now.time() >= st.session_state.target_time
-
-    # 時刻到達時の自動反転処理
-    if current_time_reached and not st.session_state.time_reached:
-        st.session_state.time_reached = True
-        st.session_state.force_color_change = True
-        save_settings(
-            st.session_state.target_time,
-            st.session_state.suffix,
-            True, True,
-            st.session_state.timer_mode,
-            st.session_state.presentation_duration,
-            st.session_state.timer_started,
-            st.session_state.timer_start_time,
-            st.session_state.timer_paused,
-            st.session_state.timer_pause_time
-        )
-        st.balloons()
-    elif not current_time_reached and not st.session_state.force_color_change:
-        st.session_state.time_reached = False
-
-# 背景色とテキスト色の設定
-if st.session_state.time_reached:
-    bg_color = "#c5487b"
-    text_color = "white"
-else:
-    bg_color = "#f5f5f5"
-    text_color = "#333333"
-
-# カスタムCSS
-st.markdown(f"""
+# ページ全体のCSS（{bg} に背景色、{text} にテキスト色を埋め込む。CSSの波括弧は二重にする）
+_CSS_TEMPLATE = """
 <style>
     .stApp {{
-        background-color: {bg_color} !important;
+        background-color: {bg} !important;
     }}
 
     .main {{
@@ -321,7 +74,7 @@ st.markdown(f"""
     .target-time {{
         font-size: 3rem;
         font-weight: bold;
-        color: {text_color};
+        color: {text};
         text-align: center;
         margin: 1rem 0;
         padding: 1rem;
@@ -332,7 +85,7 @@ st.markdown(f"""
     .current-time {{
         font-size: 6rem;
         font-weight: bold;
-        color: {text_color};
+        color: {text};
         text-align: center;
         margin: 1rem 0;
         font-family: 'Courier New', monospace;
@@ -341,7 +94,7 @@ st.markdown(f"""
 
     .date-display {{
         font-size: 1.8rem;
-        color: {text_color};
+        color: {text};
         text-align: center;
         margin: 0.5rem 0 1rem 0;
         line-height: 1;
@@ -349,7 +102,7 @@ st.markdown(f"""
 
     .time-info {{
         font-size: 1.5rem;
-        color: {text_color};
+        color: {text};
         text-align: center;
         margin: 1rem 0;
         line-height: 1;
@@ -363,7 +116,7 @@ st.markdown(f"""
         /* カウントダウンを主役に：大きく＆レスポンシブ */
         font-size: clamp(6rem, 22vw, 20rem);
         font-weight: 800;
-        color: {text_color};
+        color: {text};
         text-align: center;
         margin: 0.5rem 0;
         font-family: 'Courier New', monospace;
@@ -382,17 +135,16 @@ st.markdown(f"""
         100% {{ opacity: 1; }}
     }}
 
-    .settings-section {{
+    .st-key-settings_section {{
         margin-top: 3rem;
         padding-top: 2rem;
-        border-top: 1px solid {text_color};
-        opacity: 0.7;
+        border-top: 1px solid {text};
     }}
 
     .stButton > button {{
         background-color: transparent !important;
-        border: 2px solid {text_color} !important;
-        color: {text_color} !important;
+        border: 2px solid {text} !important;
+        color: {text} !important;
         font-size: 1.1rem !important;
         padding: 0.5rem 1.5rem !important;
         border-radius: 8px !important;
@@ -400,13 +152,13 @@ st.markdown(f"""
     }}
 
     .stButton > button:hover {{
-        background-color: {text_color} !important;
-        color: {bg_color} !important;
+        background-color: {text} !important;
+        color: {bg} !important;
     }}
 
     .stTextInput > div > div > input {{
         background-color: white !important;
-        border: 2px solid {text_color} !important;
+        border: 2px solid {text} !important;
         color: #333333 !important;
         text-align: center !important;
         font-size: 1.2rem !important;
@@ -414,7 +166,7 @@ st.markdown(f"""
 
     .stTextInput > div > div > input:focus {{
         outline: none !important;
-        box-shadow: 0 0 0 2px {text_color} !important;
+        box-shadow: 0 0 0 2px {text} !important;
     }}
 
     .stTextInput > div > div > input::placeholder {{
@@ -424,7 +176,7 @@ st.markdown(f"""
 
     .stSelectbox > div > div {{
         background-color: white !important;
-        border: 2px solid {text_color} !important;
+        border: 2px solid {text} !important;
         color: #333333 !important;
     }}
 
@@ -432,12 +184,13 @@ st.markdown(f"""
         color: #333333 !important;
     }}
 
-    .color-toggle-btn {{
+    /* 色切り替えボタンはウィジェットのキー（color_toggle）で指定する */
+    .st-key-color_toggle {{
         margin-top: 1rem;
         opacity: 0.8;
     }}
 
-    .timer-controls {{
+    .st-key-timer_controls {{
         margin-top: 2rem;
         display: flex;
         gap: 1rem;
@@ -454,108 +207,764 @@ st.markdown(f"""
     .stAlert {{
         background-color: rgba(255, 193, 7, 0.1) !important;
         border: 1px solid #ffc107 !important;
-        color: {text_color} !important;
+        color: {text} !important;
     }}
 
     .input-help {{
         font-size: 0.9rem;
-        color: {text_color};
+        color: {text};
         opacity: 0.7;
         text-align: center;
         margin-top: 0.5rem;
     }}
 </style>
-""", unsafe_allow_html=True)
-
-# --- メイン表示 ---
-if st.session_state.timer_mode == "presentation":
-    # 残り秒数の再計算（表示用）
-    if st.session_state.timer_started and not st.session_state.timer_paused and st.session_state.timer_start_time:
-        start_time = datetime.datetime.fromisoformat(st.session_state.timer_start_time)
-        elapsed_seconds = (now - start_time).total_seconds()
-        remaining_seconds = st.session_state.presentation_duration - elapsed_seconds
-    elif st.session_state.timer_paused:
-        remaining_seconds = st.session_state.timer_pause_time
+"""
+
+# 時刻入力欄をフォーカス時に全選択するスクリプト（同じ入力欄には1回だけ登録する）
+_SELECT_ON_FOCUS_SCRIPT = """
+<script>
+setTimeout(function() {
+    const inputs = document.querySelectorAll('input[type="text"]');
+    inputs.forEach(function(input) {
+        if (input.dataset.selectBound || !input.value.includes(':')) {
+            return;
+        }
+        input.dataset.selectBound = 'true';
+        input.addEventListener('focus', function() {
+            setTimeout(() => this.select(), 50);
+        });
+        input.addEventListener('click', function() {
+            setTimeout(() => this.select(), 50);
+        });
+        if (document.activeElement !== input) {
+            input.focus();
+            setTimeout(() => input.select(), 100);
+        }
+    });
+}, 500);
+</script>
+"""
+
+# 時計モードの表示をブラウザ側で毎秒更新するスクリプト（CLOCK に目標時刻やサーバーの時刻などを渡す）
+_CLOCK_SCRIPT = """
+<script>
+(function() {
+    const weekdays = ['日', '月', '火', '水', '木', '金', '土'];
+    // ブラウザの時計がサーバーとずれていても、サーバーの時刻に合わせて表示する
+    const offset = CLOCK.serverNow - Date.now();
+    const pad = (n) => String(n).padStart(2, '0');
+    // Python の divmod と同じく、時だけが負になりうる表記にそろえる
+    const hms = (total) => {
+        const hours = Math.floor(total / 3600);
+        const rest = total - hours * 3600;
+        return pad(hours) + ':' + pad(Math.floor(rest / 60)) + ':' + pad(rest % 60);
+    };
+
+    function render() {
+        // ブラウザのタイムゾーンに関係なく日本時間で表示する
+        const jst = new Date(Date.now() + offset + 9 * 3600 * 1000);
+        const nowSeconds = jst.getUTCHours() * 3600 + jst.getUTCMinutes() * 60
+            + jst.getUTCSeconds() + jst.getUTCMilliseconds() / 1000;
+        document.getElementById('clock-now').textContent =
+            pad(jst.getUTCHours()) + ':' + pad(jst.getUTCMinutes()) + ':' + pad(jst.getUTCSeconds());
+        document.getElementById('clock-date').textContent =
+            jst.getUTCFullYear() + '年' + pad(jst.getUTCMonth() + 1) + '月' + pad(jst.getUTCDate()) + '日'
+            + '（' + weekdays[jst.getUTCDay()] + '）';
+
+        let info = '';
+        if (CLOCK.reached) {
+            info = '⏱️ 経過 ' + hms(Math.trunc(nowSeconds - CLOCK.target));
+        } else if (CLOCK.countdown) {
+            const diff = CLOCK.target - nowSeconds;
+            if (diff <= 0) {
+                // サーバーが色を切り替えるまでの間も、翌日までの残りではなく経過時間を出す
+                info = '⏱️ 経過 ' + hms(Math.trunc(-diff));
+            } else {
+                info = '⏳ 残り ' + hms(Math.trunc(diff));
+            }
+        }
+        const infoEl = document.getElementById('clock-info');
+        infoEl.textContent = info;
+        infoEl.style.display = info ? '' : 'none';
+
+        // 次の秒の切り替わりに合わせて更新する
+        setTimeout(render, 1000 - (Date.now() % 1000) + 5);
+    }
+    render();
+})();
+</script>
+"""
+
+# 色切り替えボタンのラベル（現在ピンクかどうかで引く）
+_TOGGLE_LABELS = ("🎨 色をピンクに切り替え", "🎨 色をグレーに切り替え")
+
+# 時計モードの表示（iframe 内に描画する）の高さ（px）。内容に合わせて高さを決められない版でだけ使う
+CLOCK_HEIGHT = 380
+
+# 設定の既定値（時刻は 'HH:MM' 文字列のまま保持し、必要な時だけ変換する）
+DEFAULT_SETTINGS = {
+    'time': '23:59',
+    'suffix': 'から開始',
+    'timestamp': '',  # 保存時の time.time_ns()（旧形式のファイルでは ISO 文字列）
+    'color_state': False,
+    'force_color': False,
+    'timer_mode': TimerMode.CLOCK.value,
+    'presentation_duration': 900,  # 秒
+    'timer_started': False,
+    'timer_start_time': '',
+    'timer_start_epoch': 0.0,  # 開始時刻の UNIX 時間（旧形式のファイルには無い）
+    'timer_paused': False,
+    'timer_pause_time': 0
+}
+
+# --- ユーティリティ ---
+def _dumps(data):
+    """辞書を UTF-8 の JSON バイト列に変換"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def _loads(raw):
+    """UTF-8 の JSON バイト列を辞書に変換"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _normalize_input(value):
+    """入力を文字列にし、全角などを正規化（ASCII のみなら正規化は不要）"""
+    text = str(value)
+    if not text.isascii():
+        text = unicodedata.normalize('NFKC', text)
+    return text
+
+
+def _scan_digits(text):
+    """
+    数字とコロンだけを1回の走査で読み取る
+    戻り値: (コロン前の値, コロン前の桁数, コロン後の値, コロン後の桁数, コロンの数)
+    """
+    head = head_len = tail = tail_len = colons = 0
+    for ch in text:
+        if '0' <= ch <= '9':
+            digit = ord(ch) - 48
+        elif ch == ':':
+            colons += 1
+            continue
+        elif ch.isdecimal():  # ASCII 以外の数字（正規化後も残るもの）
+            digit = int(ch)
+        else:
+            continue
+        if colons:
+            tail = tail * 10 + digit
+            tail_len += 1
+        else:
+            head = head * 10 + digit
+            head_len += 1
+    return head, head_len, tail, tail_len, colons
+
+
+def parse_time_input(time_str):
+    """
+    様々な時刻入力フォーマットを解析
+    例: "07:00", "700", "0700", "7:00", "7", "19:30", "1930" など
+    """
+    if not time_str:
+        return None
+
+    hour, hour_len, minute, minute_len, colons = _scan_digits(_normalize_input(time_str))
+
+    # コロンが含まれている場合
+    if colons:
+        if colons != 1 or not hour_len or not minute_len:
+            return None
+
+    # コロンが含まれていない場合
+    elif hour_len in (1, 2):  # "7" / "07" -> "07:00"
+        minute = 0
+    elif hour_len in (3, 4):  # "700" / "0700" -> "07:00"
+        hour, minute = divmod(hour, 100)
+    else:
+        return None
+
+    # 時刻の妥当性チェック
+    if 0 <= hour <= 23 and 0 <= minute <= 59:
+        return datetime.time(hour, minute)
+    return None
+
+
+def parse_duration_input(duration_str):
+    """
+    プレゼン時間の入力フォーマットを解析
+    例: "15:00", "1500", "1:30", "90", "15" など
+
+    仕様:
+    - コロン形式の「分:秒」は分と秒をそのまま解釈
+    - コロンがない場合は、末尾2桁を秒、それ以前を分として解釈
+      （例: "1500" -> 15分0秒, "130" -> 1分30秒）
+    - 2桁以下の数字は秒として扱う
+    """
+    if not duration_str:
+        return None
+
+    minutes, minutes_len, seconds, seconds_len, colons = _scan_digits(_normalize_input(duration_str))
+
+    # コロンが含まれている場合（分:秒）
+    if colons:
+        if colons != 1 or not minutes_len or not seconds_len:
+            return None
+
+    # コロンが含まれていない場合
+    elif not minutes_len:
+        return None
+    elif minutes_len <= 2:
+        # 2桁以下は秒として扱う
+        return minutes if minutes > 0 else None
     else:
-        remaining_seconds = st.session_state.presentation_duration
-
-    # カウントダウン / オーバー表示
-    if remaining_seconds >= 0:
-        minutes = int(remaining_seconds // 60)
-        seconds = int(remaining_seconds % 60)
-        timer_display = f"{minutes:02d}:{seconds:02d}"
-        timer_class = "timer-display"
+        # それ以上は末尾2桁を秒、残りを分として扱う（分は上限なし）
+        minutes, seconds = divmod(minutes, 100)
+
+    if 0 <= seconds <= 59:
+        total = minutes * 60 + seconds
+        if total > 0:
+            return total
+    return None
+
+
+def _target_today(target_time, now):
+    """now と同じ日（日本時間）の指定時刻を作る"""
+    return datetime.datetime(now.year, now.month, now.day,
+                             target_time.hour, target_time.minute, tzinfo=JST)
+
+
+def _remaining_seconds(state, now_ts):
+    """プレゼンタイマーの残り秒数を計算（未開始・一時停止中・進行中のいずれにも対応）"""
+    if state.timer_paused:
+        return state.timer_pause_time
+    if state.timer_started and state.timer_start_time:
+        start_epoch = state.timer_start_epoch
+        if not start_epoch:
+            # 開始時刻の UNIX 時間が無い旧形式のファイルでは ISO 文字列から求める
+            start_epoch = datetime.datetime.fromisoformat(state.timer_start_time).timestamp()
+        return state.presentation_duration - (now_ts - start_epoch)
+    return state.presentation_duration
+
+
+def _tick_target(state, now, now_ts):
+    """色が切り替わる予定の時刻（UNIX 時間）を返す。予定が無ければ None"""
+    if state.timer_mode == TimerMode.PRESENTATION:
+        if state.timer_started and not state.timer_paused and state.timer_start_time:
+            return now_ts + _remaining_seconds(state, now_ts)
+        return None
+    return _target_today(state.target_time, now).timestamp()
+
+
+def _next_tick_delay(now_ts, target_ts):
+    """次に表示を更新するまでの間隔（秒）。切り替わりの前後数秒だけ細かく確認する"""
+    if target_ts is not None and abs(target_ts - now_ts) <= TICK_NEAR_WINDOW:
+        delay = TICK_NEAR
     else:
-        over_seconds = abs(remaining_seconds)
-        over_minutes = int(over_seconds // 60)
-        over_secs = int(over_seconds % 60)
-        timer_display = f"+{over_minutes:02d}:{over_secs:02d}"
-        timer_class = "timer-display overtime"
-
-    st.markdown(f"""
-    <div class="{timer_class}">
-        {timer_display}
-    </div>
-    """, unsafe_allow_html=True)
-
-    # 進行状況バー
-    total = st.session_state.presentation_duration if st.session_state.presentation_duration > 0 else 1
-    elapsed = total - max(0, remaining_seconds)
-    progress = max(0.0, min(elapsed / total, 1.0))
-    st.progress(progress)
-
-    # 現在時刻
-    st.markdown(f"""
-    <div class="current-time">
-        {now.strftime('%H:%M:%S')}
-    </div>
-    """, unsafe_allow_html=True)
-
-    # 日付
-    weekdays = ['月', '火', '水', '木', '金', '土', '日']
-    weekday = weekdays[now.weekday()]
-    st.markdown(f"""
-    <div class="date-display">
-        {now.strftime('%Y年%m月%d日')}（{weekday}）
-    </div>
-    """, unsafe_allow_html=True)
-
-    # 状態表示
-    if st.session_state.timer_started:
-        if st.session_state.timer_paused:
-            status_text = "⏸️ 一時停止中"
-        elif st.session_state.timer_start_time:
-            start_time = datetime.datetime.fromisoformat(st.session_state.timer_start_time)
-            elapsed_seconds = (now - start_time).total_seconds()
-            current_remaining = st.session_state.presentation_duration - elapsed_seconds
-            if current_remaining <= 0:
-                status_text = "⏰ 時間切れ"
+        # 時計モードでは秒の表示はブラウザ側で進むが、色や他のユーザーの変更はすぐに反映したいので
+        # どちらのモードでも1秒ごとに確認する（変更が無ければファイルの stat だけで済む）
+        delay = TICK_MAX
+    # 長い間隔でも切り替わりの手前の細かく確認する範囲を飛び越えないよう、その入口で一度確認する
+    if target_ts is not None:
+        lead = target_ts - TICK_NEAR_WINDOW - now_ts
+        if lead > 0:
+            delay = min(delay, lead)
+    return min(max(delay, TICK_MIN), TICK_MAX)
+
+
+def _aligned_now_ts():
+    """現在の UNIX 時間を返す。秒の切り替わり直前なら切り替わりを待ち、表示の秒飛び・二重表示を防ぐ"""
+    now_ts = time.time()
+    boundary = math.ceil(now_ts)
+    wait = boundary - now_ts
+    if 0 < wait < TICK_GUARD:
+        time.sleep(wait)
+        # sleep が僅かに早く戻っても切り替わり後の秒として扱う
+        now_ts = max(time.time(), boundary)
+    return now_ts
+
+
+def _settings_stat():
+    """設定ファイルの更新検知キー（mtime, サイズ, inode）を取得。ファイルを参照できなければ None"""
+    try:
+        stat = os.stat(SETTINGS_FILE)
+    except OSError:
+        return None
+    # 書き込みは毎回置き換えで新しい inode になるので、mtime の粒度が粗く同じサイズでも変更を見分けられる
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _parse_timer_mode(value):
+    """設定ファイルの表示モード（整数または旧形式の文字列）を TimerMode の値に変換"""
+    if isinstance(value, str):
+        return _LEGACY_TIMER_MODES.get(value, TimerMode.CLOCK).value
+    try:
+        return TimerMode(value).value
+    except (TypeError, ValueError):
+        return TimerMode.CLOCK.value
+
+
+@st.cache_data(max_entries=1, show_spinner=False)
+def _read_settings(stat_key):
+    """設定ファイルを解析（更新検知キーごとにキャッシュし、全セッションで共有）"""
+    with open(SETTINGS_FILE, 'rb') as f:
+        data = _loads(f.read())
+    settings = {key: data.get(key, default) for key, default in DEFAULT_SETTINGS.items()}
+    # 時刻と表示方法は必須項目
+    settings['time'] = data['time']
+    settings['suffix'] = data['suffix']
+    settings['timer_mode'] = _parse_timer_mode(settings['timer_mode'])
+    return settings
+
+
+def load_settings():
+    """設定を読み込み（プレゼンタイマー機能も含む）"""
+    try:
+        # ファイルが更新されていなければ解析済みの値をそのまま返す
+        stat_key = _settings_stat()
+        if stat_key is not None:
+            return _read_settings(stat_key)
+    except Exception:
+        pass
+    return dict(DEFAULT_SETTINGS)
+
+
+def _settings_time(settings):
+    """設定の時刻文字列を datetime.time に変換（不正な値は既定値にする）"""
+    return parse_time_input(settings['time']) or datetime.time(23, 59)
+
+
+def _write_settings(writer, args):
+    """設定を1件ファイルに書き込む（書き込み用スレッドから呼ばれる）"""
+    (target_time, suffix, color_state, force_color, timer_mode, presentation_duration,
+     timer_started, timer_start_time, timer_paused, timer_pause_time, timer_start_epoch) = args
+    try:
+        # 最後に書き込んだ時と引数が同じで、ファイルも変わっていなければ書き込まない
+        # （引数はすべてハッシュ可能なので、保存用の辞書を組み立てる前に比較できる）
+        args_hash = hash(args)
+        if args_hash == writer['hash'] and _settings_stat() == writer['stat_key']:
+            return True
+
+        data = {
+            'time': target_time.strftime('%H:%M'),
+            'suffix': suffix,
+            'color_state': color_state,
+            'force_color': force_color,
+            'timer_mode': int(timer_mode),
+            'presentation_duration': int(presentation_duration),
+            'timer_started': bool(timer_started),
+            'timer_start_time': timer_start_time,
+            'timer_start_epoch': float(timer_start_epoch),
+            'timer_paused': bool(timer_paused),
+            'timer_pause_time': int(timer_pause_time)
+        }
+
+        # 更新の印は比較にしか使わないので、整形の要らない整数（ナノ秒）にする
+        data['timestamp'] = time.time_ns()
+
+        # 一時ファイルに書き出してから置き換え、読み込み側が書きかけの内容を見ないようにする
+        # （ファイルを開いたまま書き換えると読み込み側が途中の内容を見るので、置き換えは毎回行う）
+        # 一時ファイルの名前は書き込みごとに決め、キャッシュの破棄後に残った古いスレッドや
+        # 同じディレクトリを使う別のプロセスと書き込みが混ざらないようにする
+        directory, name = os.path.split(writer['path'])
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{name}.", suffix=".tmp")
+        try:
+            # mkstemp は 0600 で作るので、他のユーザーからも読めるよう以前の open と同じ権限にそろえる（fchmod が無い環境ではそのまま）
+            if hasattr(os, 'fchmod'):
+                os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_dumps(data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, writer['path'])
+        except BaseException:
+            # 置き換えられなかった一時ファイルは残さない
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        writer['hash'] = args_hash
+        writer['stat_key'] = _settings_stat()
+        return True
+    except Exception:
+        return False
+
+
+def _writer_loop(writer):
+    """キューに入った設定を順に書き込み、結果をそれぞれの保存要求（Future）に返す"""
+    while True:
+        args, futures = writer['queue'].get()
+        # 続けて届いた設定は最新のものにまとめ、連打しても書き込み（fsync）は1回で済ませる
+        # （まとめられた要求には、代わりに書き込んだ設定の結果を返す）
+        deadline = time.monotonic() + WRITE_COALESCE
+        while True:
+            try:
+                args, newer = writer['queue'].get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            futures = futures + newer
+        ok = _write_settings(writer, args)
+        if not ok:
+            # 失敗した後は同じ内容の保存でも書き込み直す
+            writer['hash'] = None
+        for future in futures:
+            future.set_result(ok)
+
+
+@st.cache_resource
+def _settings_writer():
+    """設定ファイルへの書き込みを受け持つスレッドと、その状態（プロセス内の全セッションで共有）"""
+    # 書き込み先のパスはスレッドの開始時に一度だけ解決しておく
+    path = os.path.abspath(SETTINGS_FILE)
+    writer = {
+        'path': path,
+        # 書き込み待ちは最新の1件だけを持つ
+        'queue': queue.Queue(maxsize=1),
+        'lock': threading.Lock(),
+        # 最後に書き込んだ設定の内容
+        'hash': None,
+        'stat_key': None,
+    }
+    threading.Thread(target=_writer_loop, args=(writer,), name="settings-writer", daemon=True).start()
+    return writer
+
+
+def save_settings(target_time, suffix, color_state=False, force_color=False, timer_mode=TimerMode.CLOCK,
+                 presentation_duration=900, timer_started=False, timer_start_time="",
+                 timer_paused=False, timer_pause_time=0, timer_start_epoch=0.0):
+    """設定を保存（プレゼンタイマー機能も含む）。
+
+    書き込みは専用スレッドに任せてすぐに戻り、結果（成功なら True）は返した Future で受け取る。
+    """
+    writer = _settings_writer()
+    args = (target_time, suffix, color_state, force_color, timer_mode, presentation_duration,
+            timer_started, timer_start_time, timer_paused, timer_pause_time, timer_start_epoch)
+    future = Future()
+    with writer['lock']:
+        # まだ書き込まれていない古い設定は捨てて最新の設定だけを残し、その要求も引き継ぐ
+        try:
+            _, futures = writer['queue'].get_nowait()
+        except queue.Empty:
+            futures = []
+        writer['queue'].put_nowait((args, futures + [future]))
+    return future
+
+
+# save_settings の引数名と、その値を持つセッション状態のキー
+_SAVED_STATE_KEYS = {
+    'target_time': 'target_time',
+    'suffix': 'suffix',
+    'color_state': 'time_reached',
+    'force_color': 'force_color_change',
+    'timer_mode': 'timer_mode',
+    'presentation_duration': 'presentation_duration',
+    'timer_started': 'timer_started',
+    'timer_start_time': 'timer_start_time',
+    'timer_paused': 'timer_paused',
+    'timer_pause_time': 'timer_pause_time',
+    'timer_start_epoch': 'timer_start_epoch',
+}
+
+
+def _settings_from_state(state, **mutations):
+    """セッション状態に変更予定の値を重ねて、save_settings の引数を組み立てる"""
+    return {arg: mutations.get(key, state[key]) for arg, key in _SAVED_STATE_KEYS.items()}
+
+
+def _track_save(future, error_message):
+    """保存の結果を後で確かめられるよう、このセッションの最新の保存要求として覚えておく"""
+    st.session_state._pending_save = (future, error_message)
+
+
+def _reconcile_failed_save():
+    """最新の保存が失敗していれば、ファイルの内容から状態を取り直す。失敗していたら True"""
+    pending = st.session_state.get('_pending_save')
+    if pending is None or not pending[0].done():
+        return False
+    del st.session_state._pending_save
+    future, error_message = pending
+    if future.result():
+        return False
+    # 次の同期でファイルを必ず読み直し、保存されている内容で状態を上書きさせる
+    st.session_state.pop('_settings_mtime', None)
+    st.session_state.last_timestamp = None
+    st.session_state._save_error = error_message
+    return True
+
+
+def _apply(error_message, **mutations):
+    """変更後の状態の保存を依頼してセッション状態に反映し、ページ全体を再実行する（失敗は後で取り直す）"""
+    _track_save(save_settings(**_settings_from_state(st.session_state, **mutations)), error_message)
+    st.session_state.update(mutations)
+    st.rerun()
+
+
+def _sync_settings():
+    """設定ファイルが前回から変わっていれば読み込み、セッション状態を初期化・同期する"""
+    settings_stat = _settings_stat()
+    if settings_stat == st.session_state.get('_settings_mtime', -1):
+        return
+    settings = load_settings()
+    st.session_state._settings_mtime = settings_stat
+
+    # セッション状態の初期化
+    if 'target_time' not in st.session_state:
+        st.session_state.target_time = _settings_time(settings)
+    if 'suffix' not in st.session_state:
+        st.session_state.suffix = settings['suffix']
+    if 'last_timestamp' not in st.session_state:
+        st.session_state.last_timestamp = settings['timestamp']
+    if 'time_reached' not in st.session_state:
+        st.session_state.time_reached = False
+    if 'editing' not in st.session_state:
+        st.session_state.editing = False
+    if 'force_color_change' not in st.session_state:
+        st.session_state.force_color_change = False
+    if 'timer_mode' not in st.session_state:
+        st.session_state.timer_mode = settings['timer_mode']
+    if 'presentation_duration' not in st.session_state:
+        st.session_state.presentation_duration = settings['presentation_duration']
+    if 'timer_started' not in st.session_state:
+        st.session_state.timer_started = settings['timer_started']
+    if 'timer_start_time' not in st.session_state:
+        st.session_state.timer_start_time = settings['timer_start_time']
+    if 'timer_start_epoch' not in st.session_state:
+        st.session_state.timer_start_epoch = settings['timer_start_epoch']
+    if 'timer_paused' not in st.session_state:
+        st.session_state.timer_paused = settings['timer_paused']
+    if 'timer_pause_time' not in st.session_state:
+        st.session_state.timer_pause_time = settings['timer_pause_time']
+
+    # 他のユーザーの変更をチェック（時刻の変換は変更があった時だけ行う）
+    # last_timestamp が None なのは保存に失敗した後で、ファイルが無くても既定値に戻す
+    if settings['timestamp'] != st.session_state.last_timestamp and (
+            settings['timestamp'] != "" or st.session_state.last_timestamp is None):
+        st.session_state.target_time = _settings_time(settings)
+        st.session_state.suffix = settings['suffix']
+        st.session_state.last_timestamp = settings['timestamp']
+        st.session_state.time_reached = settings['color_state']
+        st.session_state.force_color_change = settings['force_color']
+        st.session_state.timer_mode = settings['timer_mode']
+        st.session_state.presentation_duration = settings['presentation_duration']
+        st.session_state.timer_started = settings['timer_started']
+        st.session_state.timer_start_time = settings['timer_start_time']
+        st.session_state.timer_start_epoch = settings['timer_start_epoch']
+        st.session_state.timer_paused = settings['timer_paused']
+        st.session_state.timer_pause_time = settings['timer_pause_time']
+
+
+def _page_signature(state, tick_interval):
+    """フラグメントの外側（色・ボタン・更新間隔）を左右する状態をまとめる"""
+    return (state.time_reached, state.timer_mode, state.timer_started,
+            state.timer_paused, tick_interval)
+
+
+def _request_full_rerun():
+    """ページ全体の再実行を要求する（前の要求による実行がまだ始まっていなければ重ねない）"""
+    if st.session_state.get('_rerun_in_flight'):
+        return
+    st.session_state._rerun_in_flight = True
+    st.rerun()
+
+
+def _apply_time_logic(now, now_ts):
+    """時刻到達・時間切れを判定して色の状態を更新する"""
+    if st.session_state.timer_mode == TimerMode.PRESENTATION:
+        remaining_seconds = _remaining_seconds(st.session_state, now_ts)
+
+        if st.session_state.timer_started and not st.session_state.timer_paused:
+            # 時間切れの判定
+            if (st.session_state.timer_start_time and remaining_seconds <= 0
+                    and not st.session_state.time_reached):
+                st.session_state.time_reached = True
+                st.session_state.force_color_change = True
+                _track_save(save_settings(**_settings_from_state(st.session_state)), "設定を保存できませんでした")
+                st.session_state._celebrate = True
+        elif not st.session_state.timer_paused:
+            # 未開始
+            if st.session_state.time_reached:
+                st.session_state.time_reached = False
+                st.session_state.force_color_change = False
+                _track_save(save_settings(**_settings_from_state(st.session_state)), "設定を保存できませんでした")
+    else:
+        # 通常の時計モード
+        current_time_reached = now.time() >= st.session_state.target_time
+
+        # 時刻到達時の自動反転処理
+        if current_time_reached and not st.session_state.time_reached:
+            st.session_state.time_reached = True
+            st.session_state.force_color_change = True
+            _track_save(save_settings(**_settings_from_state(st.session_state)), "設定を保存できませんでした")
+            st.session_state._celebrate = True
+        elif not current_time_reached and not st.session_state.force_color_change:
+            st.session_state.time_reached = False
+
+
+@st.cache_resource(show_spinner=False)
+def _build_css(bg_color, text_color):
+    """背景色とテキスト色からページ全体のCSSを組み立てる（色の組み合わせごとに全セッションで共有）"""
+    return _CSS_TEMPLATE.format(bg=bg_color, text=text_color)
+
+
+def _embed_html(html, fallback_height):
+    """スクリプトを含む HTML を iframe として埋め込む（st.iframe が無い版では components.html を使う）"""
+    if hasattr(st, 'iframe'):
+        # 高さは内容に合わせ、幅が狭く表示が折り返しても切れないようにする
+        return st.iframe(html, height="content")
+    # 高さを固定するしかないので、収まらない時はスクロールできるようにしておく
+    return components.html(html, height=fallback_height, scrolling=True)
+
+
+def _clock_html(target_time, suffix, time_reached, bg_color, text_color, server_ts):
+    """時計モードの表示を組み立てる（server_ts はブラウザの時計のずれを補正するためのサーバーの時刻）"""
+    config = {
+        'target': target_time.hour * 3600 + target_time.minute * 60,
+        'countdown': suffix in ("まで", "から開始"),
+        'reached': bool(time_reached),
+        'serverNow': int(server_ts * 1000),
+    }
+    return (
+        _build_css(bg_color, text_color)
+        + '<style>body { margin: 0; font-family: "Source Sans Pro", sans-serif; }</style>'
+        + f'<div class="target-time">{target_time.strftime("%H時%M分")}{suffix}</div>'
+        + '<div class="current-time" id="clock-now"></div>'
+        + '<div class="date-display" id="clock-date"></div>'
+        + '<div class="time-info" id="clock-info"></div>'
+        + f'<script>const CLOCK = {_dumps(config).decode("utf-8")};</script>'
+        + _CLOCK_SCRIPT
+    )
+
+
+# ページ全体の実行が始まったので、再実行の要求は処理済みとする
+st.session_state._rerun_in_flight = False
+# ページ全体の実行では iframe が作り直されることがあるので、時計の HTML もその時のサーバーの時刻で組み立て直す
+st.session_state.pop('_clock_html', None)
+
+# 保存に失敗していればファイルの内容に戻し、設定を読み込む（ファイルが前回から変わっていなければ読み込みも同期も省略）
+_reconcile_failed_save()
+_sync_settings()
+
+# 現在時刻（日本時間）
+now_ts = time.time()
+now = datetime.datetime.fromtimestamp(now_ts, JST)
+
+# --- 時刻到達・時間切れの判定 ---
+_apply_time_logic(now, now_ts)
+if st.session_state.pop('_celebrate', False):
+    st.balloons()
+
+# 背景色とテキスト色の設定
+if st.session_state.time_reached:
+    bg_color = "#c5487b"
+    text_color = "white"
+else:
+    bg_color = "#f5f5f5"
+    text_color = "#333333"
+
+# カスタムCSS（色の組み合わせごとに組み立てた文字列を全セッションで共有）
+st.markdown(_build_css(bg_color, text_color), unsafe_allow_html=True)
+
+
+# --- メイン表示（時計・タイマー部分だけを定期的に描き直す）---
+tick_interval = _next_tick_delay(now_ts, _tick_target(st.session_state, now, now_ts))
+st.session_state.last_render = _page_signature(st.session_state, tick_interval)
+
+
+@st.fragment(run_every=None if st.session_state.editing else tick_interval)
+def _live_display():
+    """現在時刻・残り時間などの表示部分を描画する"""
+    now_ts = _aligned_now_ts()
+    now = datetime.datetime.fromtimestamp(now_ts, JST)
+    # 保存の失敗はエラー表示のためページ全体で取り直す
+    if _reconcile_failed_save():
+        _request_full_rerun()
+    # 他のユーザーの変更はここで取り込み、フラグメントの外側に影響する変化があった時だけフル実行に切り替える
+    _sync_settings()
+    _apply_time_logic(now, now_ts)
+    next_interval = _next_tick_delay(now_ts, _tick_target(st.session_state, now, now_ts))
+    if _page_signature(st.session_state, next_interval) != st.session_state.last_render:
+        _request_full_rerun()
+
+    if st.session_state.timer_mode == TimerMode.PRESENTATION:
+        now_hms = now.strftime('%H:%M:%S')
+        now_ymd = f"{now.year}年{now.month:02d}月{now.day:02d}日"
+        weekday_char = WEEKDAYS[now.weekday()]
+        remaining_seconds = _remaining_seconds(st.session_state, now_ts)
+
+        # カウントダウン / オーバー表示
+        if remaining_seconds >= 0:
+            minutes, seconds = divmod(int(remaining_seconds), 60)
+            timer_display = f"{minutes:02d}:{seconds:02d}"
+            timer_class = "timer-display"
+        else:
+            over_minutes, over_secs = divmod(int(-remaining_seconds), 60)
+            timer_display = f"+{over_minutes:02d}:{over_secs:02d}"
+            timer_class = "timer-display overtime"
+
+        st.markdown(f'<div class="{timer_class}">{timer_display}</div>', unsafe_allow_html=True)
+
+        # 進行状況バー
+        total = st.session_state.presentation_duration if st.session_state.presentation_duration > 0 else 1
+        elapsed = total - max(0, remaining_seconds)
+        progress = max(0.0, min(elapsed / total, 1.0))
+        st.progress(progress)
+
+        # 現在時刻・日付・状態はまとめて1つの要素として描画する
+        parts = [
+            f'<div class="current-time">{now_hms}</div>',
+            f'<div class="date-display">{now_ymd}（{weekday_char}）</div>',
+        ]
+
+        # 状態表示
+        if st.session_state.timer_started:
+            if st.session_state.timer_paused:
+                status_text = "⏸️ 一時停止中"
+            elif st.session_state.timer_start_time:
+                if remaining_seconds <= 0:
+                    status_text = "⏰ 時間切れ"
+                else:
+                    status_text = "▶️ プレゼン中"
             else:
                 status_text = "▶️ プレゼン中"
         else:
-            status_text = "▶️ プレゼン中"
+            status_text = "⏹️ 停止中"
+
+        parts.append(f'<div class="time-info">{status_text}</div>')
+
+        # デバッグ情報（任意）
+        if st.session_state.timer_started and st.session_state.timer_start_time:
+            parts.append(
+                '<div class="time-info" style="font-size: 1rem; opacity: 0.6;">'
+                f'経過時間: {int(st.session_state.presentation_duration - remaining_seconds)}秒 / '
+                f'設定時間: {int(st.session_state.presentation_duration)}秒</div>'
+            )
+
+        st.markdown(''.join(parts), unsafe_allow_html=True)
+
     else:
-        status_text = "⏹️ 停止中"
-
-    st.markdown(f"""
-    <div class="time-info">
-        {status_text}
-    </div>
-    """, unsafe_allow_html=True)
-
-    # デバッグ情報（任意）
-    if st.session_state.timer_started and st.session_state.timer_start_time:
-        start_time = datetime.datetime.fromisoformat(st.session_state.timer_start_time)
-        elapsed_seconds = (now - start_time).total_seconds()
-        st.markdown(f"""
-        <div class="time-info" style="font-size: 1rem; opacity: 0.6;">
-            経過時間: {int(elapsed_seconds)}秒 / 設定時間: {int(st.session_state.presentation_duration)}秒
-        </div>
-        """, unsafe_allow_html=True)
+        # 通常の時計モード：秒の表示はブラウザ側で進めるので、サーバーからは目標や色が変わった時だけ送り直す
+        # （同じ HTML なら iframe は再読み込みされない。サーバーの時刻を含むため、組み立てはセッションごとに行い、
+        # 使い回すのはフラグメントだけの再実行の間に限る）
+        clock_key = (st.session_state.target_time, st.session_state.suffix,
+                     st.session_state.time_reached, bg_color, text_color)
+        clock = st.session_state.get('_clock_html')
+        if clock is None or clock[0] != clock_key:
+            clock = (clock_key, _clock_html(*clock_key, now_ts))
+            st.session_state._clock_html = clock
+        _embed_html(clock[1], CLOCK_HEIGHT)
+
 
-    # タイマーコントロール
-    st.markdown('<div class="timer-controls">', unsafe_allow_html=True)
-    col1, col2, col3 = st.columns(3)
+_live_display()
+
+# タイマーコントロール（保存を伴うボタンはフラグメントの外に置き、ページ全体を再実行する）
+if st.session_state.timer_mode == TimerMode.PRESENTATION:
+    col1, col2, col3 = st.container(key="timer_controls").columns(3)
 
     start_label = "▶️ スタート"
     start_disabled = False
@@ -569,179 +978,72 @@ if st.session_state.timer_mode == "presentation":
         if st.button(start_label, key="start_timer", disabled=start_disabled):
             if not st.session_state.timer_started:
                 # 新規スタート
-                st.session_state.timer_started = True
-                st.session_state.timer_start_time = now.isoformat()
-                st.session_state.timer_paused = False
-                st.session_state.timer_pause_time = 0
-                st.session_state.time_reached = False
-                st.session_state.force_color_change = False
-                save_settings(
-                    st.session_state.target_time,
-                    st.session_state.suffix,
-                    False,
-                    False,
-                    st.session_state.timer_mode,
-                    st.session_state.presentation_duration,
-                    True,
-                    st.session_state.timer_start_time,
-                    False,
-                    0
+                _apply(
+                    "タイマーの状態を保存できませんでした",
+                    timer_started=True,
+                    timer_start_time=now.isoformat(),
+                    timer_start_epoch=now_ts,
+                    timer_paused=False,
+                    timer_pause_time=0,
+                    time_reached=False,
+                    force_color_change=False,
                 )
-                st.rerun()
             elif st.session_state.timer_paused:
                 # 一時停止からの再開：残り時間でリスタートする
-                remaining = max(0, int(st.session_state.timer_pause_time))
-                st.session_state.presentation_duration = remaining
-                st.session_state.timer_paused = False
-                st.session_state.timer_pause_time = 0
-                st.session_state.timer_start_time = now.isoformat()
-                save_settings(
-                    st.session_state.target_time,
-                    st.session_state.suffix,
-                    st.session_state.time_reached,
-                    st.session_state.force_color_change,
-                    st.session_state.timer_mode,
-                    remaining,
-                    True,
-                    st.session_state.timer_start_time,
-                    False,
-                    0
+                _apply(
+                    "タイマーの状態を保存できませんでした",
+                    presentation_duration=max(0, int(st.session_state.timer_pause_time)),
+                    timer_started=True,
+                    timer_paused=False,
+                    timer_pause_time=0,
+                    timer_start_time=now.isoformat(),
+                    timer_start_epoch=now_ts,
                 )
-                st.rerun()
 
     pause_disabled = not st.session_state.timer_started or st.session_state.timer_paused
     with col2:
         if st.button("⏸️ 一時停止", key="pause_timer", disabled=pause_disabled):
             if st.session_state.timer_started and not st.session_state.timer_paused:
-                # 現在の残り時間を計算
-                if st.session_state.timer_start_time:
-                    start_time = datetime.datetime.fromisoformat(st.session_state.timer_start_time)
-                    elapsed_seconds = (now - start_time).total_seconds()
-                    current_remaining = max(0, st.session_state.presentation_duration - elapsed_seconds)
-                else:
-                    current_remaining = st.session_state.presentation_duration
-
-                st.session_state.timer_paused = True
-                st.session_state.timer_pause_time = int(current_remaining)
-                save_settings(
-                    st.session_state.target_time,
-                    st.session_state.suffix,
-                    st.session_state.time_reached,
-                    st.session_state.force_color_change,
-                    st.session_state.timer_mode,
-                    st.session_state.presentation_duration,
-                    True,
-                    st.session_state.timer_start_time,
-                    True,
-                    st.session_state.timer_pause_time
+                # 現在の残り時間で一時停止
+                _apply(
+                    "タイマーの状態を保存できませんでした",
+                    timer_paused=True,
+                    timer_pause_time=int(max(0, _remaining_seconds(st.session_state, now_ts))),
                 )
-                st.rerun()
 
     with col3:
         if st.button("⏹️ リセット", key="reset_timer"):
-            st.session_state.timer_started = False
-            st.session_state.timer_start_time = ""
-            st.session_state.timer_paused = False
-            st.session_state.timer_pause_time = 0
-            st.session_state.time_reached = False
-            st.session_state.force_color_change = False
             # リセットしても設定したプレゼン時間自体は維持
-            save_settings(
-                st.session_state.target_time,
-                st.session_state.suffix,
-                False,
-                False,
-                st.session_state.timer_mode,
-                st.session_state.presentation_duration,
-                False,
-                "",
-                False,
-                0
+            _apply(
+                "タイマーの状態を保存できませんでした",
+                timer_started=False,
+                timer_start_time="",
+                timer_start_epoch=0.0,
+                timer_paused=False,
+                timer_pause_time=0,
+                time_reached=False,
+                force_color_change=False,
             )
-            st.rerun()
-
-    st.markdown('</div>', unsafe_allow_html=True)
-
-else:
-    # 通常の時計モード
-    st.markdown(f"""
-    <div class="target-time">
-        {st.session_state.target_time.strftime('%H時%M分')}{st.session_state.suffix}
-    </div>
-    """, unsafe_allow_html=True)
-
-    st.markdown(f"""
-    <div class="current-time">
-        {now.strftime('%H:%M:%S')}
-    </div>
-    """, unsafe_allow_html=True)
-
-    weekdays = ['月', '火', '水', '木', '金', '土', '日']
-    weekday = weekdays[now.weekday()]
-
-    st.markdown(f"""
-    <div class="date-display">
-        {now.strftime('%Y年%m月%d日')}（{weekday}）
-    </div>
-    """, unsafe_allow_html=True)
-
-    # 残り時間 / 経過時間
-    if st.session_state.suffix == "まで" and not st.session_state.time_reached:
-        target_for_calc = datetime.datetime.combine(datetime.date.today(), st.session_state.target_time)
-        target_for_calc = jst.localize(target_for_calc)
-        if target_for_calc <= now:
-            target_for_calc = target_for_calc + datetime.timedelta(days=1)
-        time_diff = target_for_calc - now
-        hours, remainder = divmod(time_diff.total_seconds(), 3600)
-        minutes, seconds = divmod(remainder, 60)
-        st.markdown(f"""
-        <div class="time-info">
-            ⏳ 残り {int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}
-        </div>
-        """, unsafe_allow_html=True)
-
-    elif st.session_state.suffix == "から開始" and not st.session_state.time_reached:
-        target_for_calc = datetime.datetime.combine(datetime.date.today(), st.session_state.target_time)
-        target_for_calc = jst.localize(target_for_calc)
-        if target_for_calc <= now:
-            target_for_calc = target_for_calc + datetime.timedelta(days=1)
-        time_diff = target_for_calc - now
-        hours, remainder = divmod(time_diff.total_seconds(), 3600)
-        minutes, seconds = divmod(remainder, 60)
-        st.markdown(f"""
-        <div class="time-info">
-            ⏳ 残り {int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}
-        </div>
-        """, unsafe_allow_html=True)
 
-    elif st.session_state.time_reached:
-        target_today = datetime.datetime.combine(datetime.date.today(), st.session_state.target_time)
-        target_today = jst.localize(target_today)
-        time_diff = now - target_today
-        hours, remainder = divmod(time_diff.total_seconds(), 3600)
-        minutes, seconds = divmod(remainder, 60)
-        st.markdown(f"""
-        <div class="time-info">
-            ⏱️ 経過 {int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}
-        </div>
-        """, unsafe_allow_html=True)
 
-# --- 設定セクション（一番下）---
-st.markdown('<div class="settings-section">', unsafe_allow_html=True)
+# 編集モード（入力のたびにこのフラグメントだけを再実行する）
+@st.fragment
+def _settings_editor():
+    """設定変更フォームを描画する。確定・キャンセル時だけページ全体を再実行する"""
+    # フラグメントだけの再実行ではページ全体の now が古いので、ここで取り直す
+    now = datetime.datetime.fromtimestamp(time.time(), JST)
 
-# 編集モード
-if st.session_state.editing:
     st.markdown("### ⚙️ 設定変更")
 
     # モード選択（ラベルを明確化）
     new_timer_mode = st.selectbox(
         "表示モード",
         ["時計", "プレゼンタイマー"],
-        index=0 if st.session_state.timer_mode == "clock" else 1
+        index=0 if st.session_state.timer_mode == TimerMode.CLOCK else 1
     )
 
     if new_timer_mode == "時計":
-        new_mode = "clock"
+        new_mode = TimerMode.CLOCK.value
         # 時刻入力
         time_input = st.text_input(
             "時刻",
@@ -751,28 +1053,10 @@ if st.session_state.editing:
             key=f"time_input_field_{st.session_state.editing}"
         )
 
-        # より確実な全選択
-        st.markdown(f"""
-        <script>
-        setTimeout(function() {{
-            const inputs = document.querySelectorAll('input[type="text"]');
-            inputs.forEach(function(input) {{
-                if (input.value.includes(':')) {{
-                    input.addEventListener('focus', function() {{
-                        setTimeout(() => this.select(), 50);
-                    }});
-                    input.addEventListener('click', function() {{
-                        setTimeout(() => this.select(), 50);
-                    }});
-                    if (document.activeElement !== input) {{
-                        input.focus();
-                        setTimeout(() => input.select(), 100);
-                    }}
-                }}
-            }});
-        }}, 500);
-        </script>
-        """, unsafe_allow_html=True)
+        # より確実な全選択（スクリプトは編集を開始するたびに1回だけ送る）
+        if not st.session_state.get('_input_select_script_loaded'):
+            st.markdown(_SELECT_ON_FOCUS_SCRIPT, unsafe_allow_html=True)
+            st.session_state._input_select_script_loaded = True
 
         st.markdown(f"""
         <div class="input-help">
@@ -789,7 +1073,7 @@ if st.session_state.editing:
 
         parsed_time = parse_time_input(time_input)
         if parsed_time:
-            preview_dt = jst.localize(datetime.datetime.combine(datetime.date.today(), parsed_time))
+            preview_dt = _target_today(parsed_time, now)
             if new_suffix == "から開始" and preview_dt <= now:
                 time_status = " (開始時刻を過ぎています - 色が反転します)"
             elif new_suffix == "まで" and preview_dt <= now:
@@ -801,7 +1085,7 @@ if st.session_state.editing:
             st.warning("⚠️ 時刻の形式が正しくありません")
 
     else:
-        new_mode = "presentation"
+        new_mode = TimerMode.PRESENTATION.value
         # プレゼン時間入力（分:秒 または 分 / 秒）
         duration_input = st.text_input(
             "プレゼン時間",
@@ -830,7 +1114,7 @@ if st.session_state.editing:
         if st.button("確定"):
             if new_timer_mode == "時計":
                 if parsed_time:
-                    input_dt = jst.localize(datetime.datetime.combine(datetime.date.today(), parsed_time))
+                    input_dt = _target_today(parsed_time, now)
                     if input_dt <= now:
                         auto_color_change = True
                         auto_force_change = True
@@ -838,37 +1122,25 @@ if st.session_state.editing:
                         auto_color_change = False
                         auto_force_change = False
 
-                    if save_settings(parsed_time, new_suffix, auto_color_change, auto_force_change,
-                                     new_mode, st.session_state.presentation_duration,
-                                     st.session_state.timer_started, st.session_state.timer_start_time,
-                                     st.session_state.timer_paused, st.session_state.timer_pause_time):
-                        st.session_state.target_time = parsed_time
-                        st.session_state.suffix = new_suffix
-                        st.session_state.timer_mode = new_mode
-                        st.session_state.editing = False
-                        st.session_state.time_reached = auto_color_change
-                        st.session_state.force_color_change = auto_force_change
-                        time.sleep(0.2)
-                        st.rerun()
-                    else:
-                        st.error("設定の保存に失敗しました")
+                    _apply(
+                        "設定の保存に失敗しました",
+                        target_time=parsed_time,
+                        suffix=new_suffix,
+                        timer_mode=new_mode,
+                        editing=False,
+                        time_reached=auto_color_change,
+                        force_color_change=auto_force_change,
+                    )
                 else:
                     st.error("正しい時刻を入力してください")
             else:
                 if parsed_duration:
-                    if save_settings(st.session_state.target_time, st.session_state.suffix,
-                                     st.session_state.time_reached, st.session_state.force_color_change,
-                                     new_mode, parsed_duration,
-                                     st.session_state.timer_started, st.session_state.timer_start_time,
-                                     st.session_state.timer_paused, st.session_state.timer_pause_time):
-                        st.session_state.timer_mode = new_mode
-                        st.session_state.presentation_duration = parsed_duration
-                        st.session_state.editing = False
-                        st.success("設定を更新しました！")
-                        time.sleep(0.2)
-                        st.rerun()
-                    else:
-                        st.error("設定の保存に失敗しました")
+                    _apply(
+                        "設定の保存に失敗しました",
+                        timer_mode=new_mode,
+                        presentation_duration=parsed_duration,
+                        editing=False,
+                    )
                 else:
                     st.error("正しい時間を入力してください")
 
@@ -877,37 +1149,34 @@ if st.session_state.editing:
             st.session_state.editing = False
             st.rerun()
 
-else:
-    # 設定ボタン
-    if st.button("⚙️ 設定を変更", key="edit_button"):
-        st.session_state.editing = True
-        st.rerun()
-
-# 色切り替えボタン（プレゼンタイマーモードでは非表示）
-if st.session_state.timer_mode == "clock":
-    st.markdown('<div class="color-toggle-btn">', unsafe_allow_html=True)
-    current_color_status = "ピンク" if st.session_state.time_reached else "グレー"
-    toggle_color_status = "グレー" if st.session_state.time_reached else "ピンク"
-
-    if st.button(f"🎨 色を{toggle_color_status}に切り替え", key="color_toggle"):
-        new_color_state = not st.session_state.time_reached
-        new_force_state = new_color_state
-
-        if save_settings(st.session_state.target_time, st.session_state.suffix, new_color_state, new_force_state,
-                         st.session_state.timer_mode, st.session_state.presentation_duration,
-                         st.session_state.timer_started, st.session_state.timer_start_time,
-                         st.session_state.timer_paused, st.session_state.timer_pause_time):
-            st.session_state.time_reached = new_color_state
-            st.session_state.force_color_change = new_force_state
-            st.session_state.last_timestamp = datetime.datetime.now().isoformat()
-            st.rerun()
-        else:
-            st.error("色の変更を保存できませんでした")
-    st.markdown('</div>', unsafe_allow_html=True)
 
-st.markdown('</div>', unsafe_allow_html=True)
+# --- 設定セクション（一番下）---
+with st.container(key="settings_section"):
+    # 保存に失敗した時は、ファイルの内容に戻したことを知らせる
+    save_error = st.session_state.pop('_save_error', None)
+    if save_error:
+        st.error(save_error)
+
+    # 編集モード
+    if st.session_state.editing:
+        _settings_editor()
+    else:
+        # 設定ボタン
+        if st.button("⚙️ 設定を変更", key="edit_button"):
+            st.session_state.editing = True
+            st.session_state._input_select_script_loaded = False
+            st.rerun()
 
-# --- 自動リフレッシュ制御（編集中は止める）---
-if not st.session_state.editing:
-    time.sleep(1)
-    st.rerun()
+    # 色切り替えボタン（プレゼンタイマーモードでは非表示）
+    if st.session_state.timer_mode == TimerMode.CLOCK:
+        if st.button(_TOGGLE_LABELS[st.session_state.time_reached], key="color_toggle"):
+            new_color_state = not st.session_state.time_reached
+            # 比較にしか使わないので、時刻を整形せずセッション内の連番で印を付ける
+            revision = st.session_state.get('_revision', 0) + 1
+            _apply(
+                "色の変更を保存できませんでした",
+                time_reached=new_color_state,
+                force_color_change=new_color_state,
+                _revision=revision,
+                last_timestamp=revision,
+            )